@@ -46,6 +46,10 @@
 #   1.1 - removed newline characters for regex matching
 #       - enhanced txt output for readability
 #   2.1 - [varbytes] updated regex strings to byte strings for Python 3 compatibility
+#   2.2 - [varbytes] scan memory mapped 64 KiB pages instead of reading 4 lines at a time
+#       - find bindings, consumers, and filters in a single pass over OBJECTS.DATA
+#       - stream files that can't be memory mapped in 64 KiB reads
+#       - scan files of 64 MiB or more across a process pool
 #
 # Future Improvements:
 #   [ ] Implement named regex groups for clarity
@@ -79,170 +83,487 @@
 #
 
 from __future__ import print_function
+import os
 import sys
 import re
+import mmap
 import string
 import locale
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
-PRINTABLE_CHARS = set(string.printable)
+# pyahocorasick is optional, bytes.find is used to look for names when it isn't installed
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# hyperscan is optional, re is used to scan the pages when it isn't installed
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+# Encoding used to print carved consumer and filter details. Bytes that aren't valid in it are
+#   printed as \x escapes, which any stdout encoding can write
+ENC = locale.getpreferredencoding(False)
+
+# Consumer and filter names of bindings that are commonly legitimate
+COMMON_BINDINGS = (
+    (b"BVTConsumer", b"BVTFilter"),
+    (b"SCM Event Log Consumer", b"SCM Event Log Filter"))
+
+# Bytes stripped from command line consumer arguments
+NON_PRINTABLE = bytes(byte for byte in range(256) if chr(byte) not in string.printable)
+
+# Constants:
+CHUNK_SIZE = 0x10000 # Scan OBJECTS.DATA in 64 KiB windows
+MAX_RECORD_SIZE = 0x4000 # Overlap windows by 16 KiB so records on a window boundary are not missed
+MAX_NAME_SIZE = 0x100 # Carve up to 256 bytes in front of a filter query to capture the filter name
+MAX_TYPE_GAP = 0x100 # Look up to 256 bytes in front of a consumer name for its consumer type
+MAX_TYPE_SIZE = 0x40 # Longest consumer type prefix in front of "EventConsumer"
+PARALLEL_MIN_SIZE = 0x4000000 # Split files of 64 MiB or more across a process pool
+SPANS_PER_WORKER = 4 # Give each process a few spans of the file so they all stay busy
+MAX_WINDOWS_WORKERS = 61 # ProcessPoolExecutor refuses more processes than this on Windows
+
+# Consumer type and delimiter a command line consumer record starts with
+COMMAND_LINE_HEADER = b"CommandLineEventConsumer\x00\x00"
+
+# Matches the word in front of "EventConsumer" when searched with endpos at its offset
+CONSUMER_TYPE_MO = re.compile(rb"\w*\Z")
+
+# Matches a FilterToConsumerBinding along with the consumer and filter names that follow it in
+#   either order, so both names are found with a single match at each binding
+BINDING_MO = re.compile(
+    rb"_FilterToConsumerBinding"
+    rb"(?=.{0,%d}?EventConsumer\.Name\=\"([\w\s]*)\")"
+    rb"(?=.{0,%d}?_EventFilter\.Name\=\"([\w\s]*)\")" % (MAX_RECORD_SIZE, MAX_RECORD_SIZE),
+    re.DOTALL)
+
+# Patterns each page is scanned for, indexed by the kind of hit they produce
+BINDING_HIT, CONSUMER_HIT, FILTER_HIT = range(3)
+PAGE_PATTERNS = (
+    rb"_FilterToConsumerBinding",
+    rb"EventConsumer",
+    rb"\x00\x00[Ss][Ee][Ll][Ee][Cc][Tt]\b")
+
+def iter_streamed_pages(objects_fd):
+    """Yield overlapping CHUNK_SIZE pages of an OBJECTS.DATA file read with os.read, along with
+    the buffer holding each page and the file offset of that buffer"""
+
+    objects_buffer = b""
+    buffer_offset = 0
+    page_offset = 0
+    at_eof = False
+
+    while True:
+        # Read until the buffer holds the page and any record that starts at the end of it
+        while (
+                not at_eof and
+                buffer_offset + len(objects_buffer) < page_offset + CHUNK_SIZE + MAX_RECORD_SIZE):
+            chunk = os.read(objects_fd, CHUNK_SIZE)
+            if chunk:
+                objects_buffer += chunk
+            else:
+                at_eof = True
+
+        page_start = page_offset - buffer_offset
+        page_end = min(page_start + CHUNK_SIZE, len(objects_buffer))
+        if page_start >= page_end:
+            break
+        yield objects_buffer, buffer_offset, page_start, page_end
+        if at_eof and page_start + CHUNK_SIZE >= len(objects_buffer):
+            break
+
+        # Only keep what the next page and the names carved in front of its hits still need
+        page_offset += CHUNK_SIZE - MAX_RECORD_SIZE
+        unused_size = max(0, page_offset - MAX_NAME_SIZE - buffer_offset)
+        objects_buffer = objects_buffer[unused_size:]
+        buffer_offset += unused_size
+
+def iter_mapped_pages(objects_map, span_start, span_end):
+    """Yield the overlapping CHUNK_SIZE pages of a memory mapped OBJECTS.DATA file that start
+    between two offsets, in the same form as iter_streamed_pages"""
+
+    for start in range(span_start, span_end, CHUNK_SIZE - MAX_RECORD_SIZE):
+        # Pages are searched in place rather than copied out of the map
+        yield objects_map, 0, start, min(start + CHUNK_SIZE, len(objects_map))
+        if start + CHUNK_SIZE >= len(objects_map):
+            break
+
+def build_page_scanner():
+    """Return a function that returns the kind and offset of each PAGE_PATTERNS hit between
+    two offsets of a buffer"""
+
+    if hyperscan:
+        # Match every pattern in a single scan of the page
+        database = hyperscan.Database()
+        database.compile(
+            expressions=list(PAGE_PATTERNS),
+            ids=list(range(len(PAGE_PATTERNS))),
+            elements=len(PAGE_PATTERNS),
+            flags=[hyperscan.HS_FLAG_SOM_LEFTMOST] * len(PAGE_PATTERNS))
+
+        def on_match(hit_kind, hit_start, hit_end, flags, page_hits):
+            page_hits.append((hit_kind, hit_start))
+
+        def scan_page(objects_buffer, page_start, page_end):
+            page_hits = []
+            with memoryview(objects_buffer)[page_start:page_end] as potential_page:
+                database.scan(potential_page, match_event_handler=on_match, context=page_hits)
+            return [(hit_kind, page_start + hit_start) for hit_kind, hit_start in page_hits]
+
+    else:
+        page_mos = [re.compile(page_pattern) for page_pattern in PAGE_PATTERNS]
+
+        def scan_page(objects_buffer, page_start, page_end):
+            return [
+                (hit_kind, page_match.start())
+                for hit_kind, page_mo in enumerate(page_mos)
+                for page_match in page_mo.finditer(objects_buffer, page_start, page_end)]
+
+    return scan_page
+
+def build_name_finder(names):
+    """Return a function that yields the offset and name of each of the names in a record"""
+
+    # Empty names would match everywhere, so they are never looked for
+    names = [name for name in names if name]
+
+    if ahocorasick and names:
+        # Scan each record once for every name. latin-1 maps each byte to one character so
+        #   offsets in the decoded record are the same as in the raw record
+        automaton = ahocorasick.Automaton()
+        for name in names:
+            automaton.add_word(name.decode("latin-1"), name)
+        automaton.make_automaton()
+
+        def find_names(record):
+            for name_end, name in automaton.iter(record.decode("latin-1")):
+                yield name_end - len(name) + 1, name
+
+    else:
+        def find_names(record):
+            for name in names:
+                name_offset = record.find(name)
+                while name_offset != -1:
+                    yield name_offset, name
+                    name_offset = record.find(name, name_offset + 1)
+
+    return find_names
+
+def build_name_alternation(names):
+    """Return a regex alternation of the non-empty names, longest first so a name is never
+    matched as just the start of a longer one"""
+
+    return b"|".join(
+        re.escape(name) for name in sorted((name for name in names if name), key=len, reverse=True))
+
+def carve_consumer_details(consumer_record, name_offset, event_consumer_name):
+    """Return the details of the consumer whose name was found at name_offset in a carved
+    record, or None if the name isn't part of a consumer"""
+
+    # The name must be followed by two null delimited values
+    trailer_offset = name_offset + len(event_consumer_name)
+    if consumer_record[trailer_offset:trailer_offset + 2] != b"\x00\x00":
+        return None
+    first_end = consumer_record.find(b"\x00", trailer_offset + 2)
+    if first_end == -1 or consumer_record[first_end + 1:first_end + 2] != b"\x00":
+        return None
+    second_end = consumer_record.find(b"\x00", first_end + 2)
+    if second_end == -1:
+        second_end = len(consumer_record)
+
+    # The consumer type must be shortly before the name and must be the one the record was
+    #   carved from. Any other consumer in the record is carved from its own record
+    gap_offset = max(0, name_offset - MAX_TYPE_GAP)
+    suffix_offset = consumer_record.rfind(b"EventConsumer", gap_offset, name_offset)
+    if suffix_offset == -1:
+        return None
+    if CONSUMER_TYPE_MO.search(
+            consumer_record, max(0, suffix_offset - MAX_TYPE_SIZE), suffix_offset).start():
+        return None
+    consumer_type = consumer_record[:suffix_offset + len(b"EventConsumer")]
+
+    return b"%b ~ %b ~ %b ~ %b" % (
+        consumer_type,
+        event_consumer_name,
+        consumer_record[trailer_offset + 2:first_end],
+        consumer_record[first_end + 2:second_end])
+
+def carve_command_line_consumer(consumer_record, name_hits):
+    """Return the name and details of the command line consumer a record was carved from,
+    given the offset and name of each consumer name found in it, or None if it isn't one"""
+
+    # The arguments run up to the first null after the consumer type
+    if not consumer_record.startswith(COMMAND_LINE_HEADER):
+        return None
+    arguments_offset = len(COMMAND_LINE_HEADER)
+    arguments_end = consumer_record.find(b"\x00", arguments_offset)
+    if arguments_end == -1:
+        return None
+
+    # The first name after the arguments belongs to the consumer, the longest one if several
+    #   names start at the same offset
+    name_hits = [name_hit for name_hit in name_hits if name_hit[0] > arguments_end]
+    if not name_hits:
+        return None
+    name_offset, event_consumer_name = min(
+        name_hits, key=lambda name_hit: (name_hit[0], -len(name_hit[1])))
+
+    # Anything up to the next null after the name is kept as well
+    other_offset = name_offset + len(event_consumer_name)
+    if consumer_record[other_offset:other_offset + 2] == b"\x00\x00":
+        other_offset += 2
+    other_end = consumer_record.find(b"\x00", other_offset)
+    if other_end == -1:
+        other_end = len(consumer_record)
+
+    consumer_details = (
+        b"\n\t\tConsumer Type: CommandLineEventConsumer\n\t\tArguments:     %b" %
+        consumer_record[arguments_offset:arguments_end].translate(None, NON_PRINTABLE))
+    consumer_details += b"\n\t\tConsumer Name: %b" % event_consumer_name
+    if other_end > other_offset:
+        consumer_details += b"\n\t\tOther:         %b" % consumer_record[other_offset:other_end]
+    return event_consumer_name, consumer_details
+
+def scan_pages(pages):
+    """Find every binding and carve every potential consumer and filter record in a single
+    pass over the pages of an OBJECTS.DATA file"""
+
+    #Dictionary that will store bindings
+    bindings_dict = {}
+
+    #Dictionaries that will store every potential consumer and filter record by file offset
+    #   so they can be matched to the bindings once the whole file has been read
+    consumer_records = {}
+    filter_records = {}
+
+    # Bind everything used for each hit to a local name. The byte crunching happens in C,
+    #   so the time spent in this loop is mostly Python looking names up
+    scan_page = build_page_scanner()
+    match_binding = BINDING_MO.match
+    search_consumer_type = CONSUMER_TYPE_MO.search
+    binding_hit = BINDING_HIT
+    consumer_hit = CONSUMER_HIT
+    max_record_size = MAX_RECORD_SIZE
+    max_type_gap = MAX_TYPE_GAP
+
+    for objects_buffer, buffer_offset, page_start, page_end in pages:
+        find_in_buffer = objects_buffer.find
+        for hit_kind, hit_offset in scan_page(objects_buffer, page_start, page_end):
+            # Match the consumer and filter names that follow each FilterToConsumerBinding
+            if hit_kind == binding_hit:
+                binding_match = match_binding(
+                    objects_buffer, hit_offset, hit_offset + max_record_size)
+                if binding_match:
+                    #Key the binding by its names and add it to the dict, it is only given a
+                    #   printable name when the results are printed
+                    binding_key = binding_match.groups()
+                    if binding_key not in bindings_dict:
+                        bindings_dict[binding_key] = {
+                            "event_consumer_name":binding_key[0],
+                            "event_filter_name":binding_key[1]}
+
+            # Carve everything that may be a consumer record, starting at its consumer type
+            elif hit_kind == consumer_hit:
+                record_offset = buffer_offset + hit_offset
+                if record_offset in consumer_records:
+                    continue
+                type_offset = search_consumer_type(
+                    objects_buffer, max(0, hit_offset - MAX_TYPE_SIZE), hit_offset).start()
+                record_end = type_offset + max_record_size
+
+                # A command line consumer's name can be anywhere after its arguments, so it keeps
+                #   the whole record. Any other consumer's name is within MAX_TYPE_GAP of its type
+                #   and can't contain a null, so the record ends at most three null delimiters
+                #   later, after the two values that follow the name
+                header_end = type_offset + len(COMMAND_LINE_HEADER)
+                if objects_buffer[type_offset:header_end] != COMMAND_LINE_HEADER:
+                    trailer_end = hit_offset + max_type_gap
+                    for _ in range(3):
+                        trailer_end = find_in_buffer(b"\x00", trailer_end, record_end)
+                        if trailer_end == -1:
+                            break
+                        trailer_end += 2
+                    else:
+                        record_end = min(trailer_end, record_end)
+                consumer_records[record_offset] = objects_buffer[type_offset:record_end]
+
+            # Carve the name and WQL query of everything that may be a filter record
+            else:
+                record_offset = buffer_offset + hit_offset
+                if record_offset in filter_records:
+                    continue
+                query_end = find_in_buffer(b"\x00", hit_offset + 2, hit_offset + max_record_size)
+                if query_end != -1 and objects_buffer[query_end + 1:query_end + 2] == b"\x00":
+                    filter_records[record_offset] = objects_buffer[
+                        max(0, hit_offset - MAX_NAME_SIZE):query_end + 2]
+
+    return bindings_dict, consumer_records, filter_records
+
+def scan_objects_span(objects_path, span_start, span_end):
+    """Scan the pages of an OBJECTS.DATA file that start between two offsets. This runs in a
+    worker process, so it maps the file itself"""
+
+    with open(objects_path, "rb") as objects_file:
+        objects_map = mmap.mmap(objects_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return scan_pages(iter_mapped_pages(objects_map, span_start, span_end))
+        finally:
+            objects_map.close()
+
+def scan_objects_file(objects_path):
+    """Find every binding and carve every potential consumer and filter record in an
+    OBJECTS.DATA file, splitting large files across a process pool"""
+
+    with open(objects_path, "rb") as objects_file:
+        try:
+            objects_map = mmap.mmap(objects_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError, OverflowError):
+            # Empty files, pipes, devices, and files too large for the address space can't be
+            #   memory mapped, so they are streamed in 64 KiB reads instead
+            return scan_pages(iter_streamed_pages(objects_file.fileno()))
+
+        try:
+            objects_size = len(objects_map)
+            workers = os.cpu_count() or 1
+            if sys.platform == "win32":
+                workers = min(workers, MAX_WINDOWS_WORKERS)
+            if objects_size < PARALLEL_MIN_SIZE or workers < 2:
+                return scan_pages(iter_mapped_pages(objects_map, 0, objects_size))
+        finally:
+            objects_map.close()
+
+    # Split the file into page aligned spans so the workers scan the same pages a single
+    #   process would
+    page_step = CHUNK_SIZE - MAX_RECORD_SIZE
+    span_size = page_step * -(-objects_size // (page_step * workers * SPANS_PER_WORKER))
+    span_starts = range(0, objects_size, span_size)
+    span_ends = [min(span_start + span_size, objects_size) for span_start in span_starts]
+
+    bindings_dict = {}
+    consumer_records = {}
+    filter_records = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Spans are merged in file order so bindings keep the order they were found in
+        for span_bindings, span_consumer_records, span_filter_records in executor.map(
+                scan_objects_span, repeat(objects_path), span_starts, span_ends):
+            bindings_dict.update(span_bindings)
+            consumer_records.update(span_consumer_records)
+            filter_records.update(span_filter_records)
+
+    return bindings_dict, consumer_records, filter_records
 
 def main():
     """Main function for everything!"""
 
     print("\n    Enumerating FilterToConsumerBindings...")
 
-    #Read objects.data 4 lines at a time to look for bindings
-    objects_file = open(sys.argv[1], "rb")
-    current_line = objects_file.readline()
-    lines_list = [current_line]
-    current_line = objects_file.readline()
-    lines_list.append(current_line)
-    current_line = objects_file.readline()
-    lines_list.append(current_line)
-    current_line = objects_file.readline()
-    lines_list.append(current_line)
-
-    #Precompiled match objects to search each line with
-    event_consumer_mo = re.compile(rb"([\w\_]*EventConsumer\.Name\=\")([\w\s]*)(\")")
-    event_filter_mo = re.compile(rb"(_EventFilter\.Name\=\")([\w\s]*)(\")")
-
-    #Dictionaries that will store bindings, consumers, and filters
-    bindings_dict = {}
+    bindings_dict, consumer_records, filter_records = scan_objects_file(sys.argv[1])
+
+    #Dictionaries that will store consumers and filters for the bindings
+    #The details are stored as dict keys to avoid duplicates as the same record may be carved
+    #   more than once, a dict keeps them in the order they were carved unlike set()
     consumer_dict = {}
     filter_dict = {}
+    for binding_details in bindings_dict.values():
+        consumer_dict.setdefault(binding_details["event_consumer_name"], {})
+        filter_dict.setdefault(binding_details["event_filter_name"], {})
 
-    while current_line:
-        # Join all the read lines together (should always be 4) to look for bindings spread over
-        #   multiple lines that may have been one page
-        potential_page = b" ".join(lines_list)
-
-        # Look for FilterToConsumerBindings
-        if b"_FilterToConsumerBinding" in potential_page:
-            if (
-                    re.search(event_consumer_mo, potential_page) and
-                    re.search(event_filter_mo, potential_page)):
-                event_consumer_name = re.search(event_consumer_mo, potential_page).groups(0)[1]
-                event_filter_name = re.search(event_filter_mo, potential_page).groups(0)[1]
-
-                #Add the consumers and filters to their dicts if they don't already exist
-                #set() is used to avoid duplicates as we go through the lines
-                if event_consumer_name not in consumer_dict:
-                    consumer_dict[event_consumer_name] = set()
-                if event_filter_name not in filter_dict:
-                    filter_dict[event_filter_name] = set()
-
-                #Give the binding a name and add it to the dict
-                binding_id = (b"%b-%b" % (event_consumer_name, event_filter_name)).decode()
-                if binding_id not in bindings_dict:
-                    bindings_dict[binding_id] = {
-                        "event_consumer_name":event_consumer_name,
-                        "event_filter_name":event_filter_name}
-
-        # Increment lines and look again
-        current_line = objects_file.readline()
-        lines_list.append(current_line)
-        lines_list.pop(0)
-
-    # Close the file and look for consumers and filters
-    objects_file.close()
+    # Match the carved consumers and filters to the bindings
     print("    {} FilterToConsumerBinding(s) Found. Enumerating Filters and Consumers..."
           .format(len(bindings_dict)))
 
-    # Read objects.data 4 lines at a time to look for filters and consumers
-    objects_file = open(sys.argv[1], "rb")
-    current_line = objects_file.readline()
-    lines_list = [current_line]
-    current_line = objects_file.readline()
-    lines_list.append(current_line)
-    current_line = objects_file.readline()
-    lines_list.append(current_line)
-    current_line = objects_file.readline()
-    lines_list.append(current_line)
-
-    while current_line:
-        potential_page = b" ".join(lines_list).replace(b"\n", b"")
-
-        # Check each potential page for the consumers we are looking for
-        if b"EventConsumer" in potential_page:
-            for event_consumer_name, event_consumer_details in consumer_dict.items():
-                # Can't precompile regex because it is dynamically created with each consumer name
-                if b"CommandLineEventConsumer" in potential_page:
-                    consumer_mo = re.compile(b"(CommandLineEventConsumer)(\x00\x00)(.*?)(\x00)(.*?)"
-                                             b"(%b)(\x00\x00)?([^\x00]*)?" % event_consumer_name)
-                    consumer_match = re.search(consumer_mo, potential_page)
-                    if consumer_match:
-                        noisy_string = consumer_match.groups()[2]
-                        consumer_details = b"\n\t\tConsumer Type: {}\n\t\tArguments:     {}".format(
-                            consumer_match.groups()[0],
-                            filter(lambda event_consumer_name: event_consumer_name in
-                                   PRINTABLE_CHARS, noisy_string))
-                        if consumer_match.groups()[5]:
-                            consumer_details += b"\n\t\tConsumer Name: {}".format(consumer_match.groups()[5])
-                        if consumer_match.groups()[7]:
-                            consumer_details += b"\n\t\tOther:         {}".format(consumer_match.groups()[7])
-                        consumer_dict[event_consumer_name].add(consumer_details)
-
-                else:
-                    consumer_mo = re.compile(
-                        rb"(\w*EventConsumer)(.*?)(%b)(\x00\x00)([^\x00]*)(\x00\x00)([^\x00]*)" % event_consumer_name)
-                    consumer_match = re.search(consumer_mo, potential_page)
-                    if consumer_match:
-                        consumer_details = b"%b ~ %b ~ %b ~ %b" % (
-                            consumer_match.groups()[0],
-                            consumer_match.groups()[2],
-                            consumer_match.groups()[4],
-                            consumer_match.groups()[6])
-                        consumer_dict[event_consumer_name].add(consumer_details)
-
-        # Check each potential page for the filters we are looking for
-        for event_filter_name, event_filter_details in filter_dict.items():
-            if event_filter_name in potential_page:
-                # Can't precompile regex because it is dynamically created with each filter name
-                filter_mo = re.compile(
-                    rb"(%b)(\x00\x00)([^\x00]*)(\x00\x00)" % event_filter_name)
-                filter_match = re.search(filter_mo, potential_page)
-                if filter_match:
-                    filter_details = b"\n\t\tFilter name:  %b\n\t\tFilter Query: %b" % (
-                        filter_match.groups()[0],
-                        filter_match.groups()[2])
-                    filter_dict[event_filter_name].add(filter_details)
-
-        current_line = objects_file.readline()
-        lines_list.append(current_line)
-        lines_list.pop(0)
-    objects_file.close()
-    
+    # Precompile one match object for all of the filter names, the matched name tells us
+    #   which filter was found. Filter records are carved to end with their query, so the
+    #   match is anchored there and only the name right in front of the query counts
+    filter_alternation = build_name_alternation(filter_dict)
+    filter_mo = re.compile(rb"(%b)(\x00\x00)([^\x00]*)(\x00\x00)\Z" % filter_alternation)
+
+    find_consumer_names = build_name_finder(consumer_dict)
+
+    # Check each potential consumer record for the consumers we are looking for, only parsing
+    #   the record where their names are actually found
+    for consumer_record in consumer_records.values():
+        name_hits = list(find_consumer_names(consumer_record))
+        if not name_hits:
+            continue
+
+        # Records are carved from their consumer type, so only the type word at the start of
+        #   the record says what kind of consumer it is
+        if consumer_record.startswith(b"CommandLineEventConsumer"):
+            command_line_consumer = carve_command_line_consumer(consumer_record, name_hits)
+            if command_line_consumer:
+                event_consumer_name, consumer_details = command_line_consumer
+                consumer_dict[event_consumer_name][consumer_details] = None
+
+        else:
+            # The first name after the type that carves belongs to the consumer, the longest
+            #   one if several names start at the same offset. Names further on may be in the
+            #   records that follow it, such as a filter that shares the consumer's name
+            for name_offset, event_consumer_name in sorted(
+                    name_hits, key=lambda name_hit: (name_hit[0], -len(name_hit[1]))):
+                consumer_details = carve_consumer_details(
+                    consumer_record, name_offset, event_consumer_name)
+                if consumer_details:
+                    consumer_dict[event_consumer_name][consumer_details] = None
+                    break
+
+    # Check each potential filter record for the filters we are looking for. An empty
+    #   alternation would match anywhere, so there is nothing to look for without filter names
+    if filter_alternation:
+        for filter_record in filter_records.values():
+            filter_match = filter_mo.search(filter_record)
+            if filter_match:
+                filter_details = b"\n\t\tFilter name:  %b\n\t\tFilter Query: %b" % (
+                    filter_match.groups()[0],
+                    filter_match.groups()[2])
+                filter_dict[filter_match.groups()[0]][filter_details] = None
+
     # Print results to stdout. CSV will be in future version.
-    print("\n    Bindings:\n")
-    for binding_name, binding_details in bindings_dict.items():
-        if (
-                "BVTConsumer-BVTFilter" in binding_name or
-                "SCM Event Log Consumer-SCM Event Log Filter" in binding_name):
-            print(
+    #   The report is built up as a list of lines and written once, instead of taking the
+    #   stdout lock and encoding on every print() for each binding, consumer, and filter
+    report_lines = ["\n    Bindings:\n"]
+    for binding_key, binding_details in bindings_dict.items():
+        binding_name = (b"%b-%b" % binding_key).decode(ENC, errors="backslashreplace")
+        if binding_key in COMMON_BINDINGS:
+            report_lines.append(
                 "        {}\n                (Common binding based on consumer and filter names,"
                 " possibly legitimate)".format(binding_name))
         else:
-            print("        {}".format(binding_name))
+            report_lines.append("        {}".format(binding_name))
         event_filter_name = binding_details["event_filter_name"]
         event_consumer_name = binding_details["event_consumer_name"]
 
         # Print binding details if available
         if consumer_dict[event_consumer_name]:
             for event_consumer_details in consumer_dict[event_consumer_name]:
-                print("            Consumer: {}".format(event_consumer_details.decode(locale.getpreferredencoding())))
+                report_lines.append("            Consumer: {}".format(
+                    event_consumer_details.decode(ENC, errors="backslashreplace")))
         else:
-            print("            Consumer: {}".format(event_consumer_name.decode(locale.getpreferredencoding())))
+            report_lines.append("            Consumer: {}".format(
+                event_consumer_name.decode(ENC, errors="backslashreplace")))
 
         # Print details for each filter found for this filter name
         for event_filter_details in filter_dict[event_filter_name]:
-            print("\n            Filter: {}".format(event_filter_details.decode(locale.getpreferredencoding())))
-            print()
+            report_lines.append("\n            Filter: {}".format(
+                event_filter_details.decode(ENC, errors="backslashreplace")))
+            report_lines.append("")
 
     # Print closing message
-    print("\n    Thanks for using PyWMIPersistenceFinder! Please contact @DavidPany with "
-          "questions, bugs, or suggestions.\n\n    Please review FireEye's whitepaper "
-          "for additional WMI persistence details:\n        https://www.fireeye.com/content/dam"
-          "/fireeye-www/global/en/current-threats/pdfs/wp-windows-management-instrumentation.pdf")
+    report_lines.append(
+        "\n    Thanks for using PyWMIPersistenceFinder! Please contact @DavidPany with "
+        "questions, bugs, or suggestions.\n\n    Please review FireEye's whitepaper "
+        "for additional WMI persistence details:\n        https://www.fireeye.com/content/dam"
+        "/fireeye-www/global/en/current-threats/pdfs/wp-windows-management-instrumentation.pdf")
+
+    # Escape anything stdout's own encoding can't write, so one character can't lose the whole
+    #   report when stdout doesn't use ENC
+    report = "\n".join(report_lines) + "\n"
+    stdout_encoding = sys.stdout.encoding or ENC
+    sys.stdout.write(
+        report.encode(stdout_encoding, errors="backslashreplace").decode(stdout_encoding))
 
 if __name__ == "__main__":
     main()